@@ -1,3 +1,144 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from .consumers import AsyncChatConsumer
+from .routing import websocket_urlpatterns
+
+
+application = URLRouter(websocket_urlpatterns)
+
+
+class RoomNameTests(SimpleTestCase):
+    async def test_longest_valid_room_name_is_accepted(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/" + "r" * 94 + "/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def test_room_name_too_long_for_group_is_rejected(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/" + "r" * 95 + "/")
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4400)
+
+    async def test_non_ascii_room_name_is_rejected(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/café/")
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4400)
+
+
+class ChatMessageTests(SimpleTestCase):
+    @override_settings(CHAT_FLUSH_DELAY=0.1)
+    async def test_room_members_receive_batched_binary_frames(self):
+        sender = WebsocketCommunicator(application, "/ws/chat/batch/")
+        listener = WebsocketCommunicator(application, "/ws/chat/batch/")
+        for communicator in (sender, listener):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+        await sender.send_to(text_data='{"message": "hello"}')
+        await sender.send_to(bytes_data=b'{"message": "world"}')
+
+        for communicator in (sender, listener):
+            output = await communicator.receive_output()
+            self.assertEqual(
+                output,
+                {"type": "websocket.send", "bytes": b'{"messages":["hello","world"]}'},
+            )
+            await communicator.disconnect()
+
+
+class SlowChatConsumer(AsyncChatConsumer):
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        await asyncio.sleep(1)
+
+
+class DisconnectedChatConsumer(AsyncChatConsumer):
+    # Behaves like uvicorn once the peer has gone: both send and close raise
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.instances.append(self)
+        self.flush_task = None
+        self.close_calls = 0
+
+    async def _flush_after(self, delay):
+        self.flush_task = asyncio.current_task()
+        await super()._flush_after(delay)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        raise RuntimeError("client went away")
+
+    async def close(self, code=None):
+        self.close_calls += 1
+        raise RuntimeError("Unexpected ASGI message 'websocket.close'")
+
+
+class SheddingTests(SimpleTestCase):
+    async def assert_shed(self, consumer, room_name):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), "/ws/chat/%s/" % room_name)
+        communicator.scope["url_route"] = {"kwargs": {"room_name": room_name}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_to(text_data='{"message": "hello"}')
+        self.assertEqual(
+            await communicator.receive_output(), {"type": "websocket.close", "code": 1013}
+        )
+        await communicator.disconnect()
+
+    @override_settings(CHAT_SEND_TIMEOUT=0.05)
+    async def test_slow_send_closes_with_try_again_later(self):
+        await self.assert_shed(SlowChatConsumer, "slow")
+
+    async def test_failed_send_leaves_the_room_without_raising(self):
+        communicator = WebsocketCommunicator(
+            DisconnectedChatConsumer.as_asgi(), "/ws/chat/gone/"
+        )
+        communicator.scope["url_route"] = {"kwargs": {"room_name": "gone"}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_to(text_data='{"message": "hello"}')
+        self.assertTrue(await communicator.receive_nothing())
+
+        consumer = DisconnectedChatConsumer.instances[-1]
+        # Awaiting the flush task re-raises anything that escaped it
+        await consumer.flush_task
+        self.assertTrue(consumer._closing)
+        self.assertIsNone(consumer._flush_task)
+        self.assertEqual(consumer.close_calls, 0)
+        await communicator.disconnect()
+
+class RoomViewTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_revisit_with_matching_etag_is_not_modified(self):
+        url = reverse("room", args=["lobby"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_the_template(self):
+        url = reverse("room", args=["lobby"])
+        etag = self.client.get(url)["ETag"]
+        # The page cache keeps serving the old page with its old ETag until it expires
+        cache.clear()
+
+        with mock.patch("chatServerApp.views.get_template") as get_template:
+            get_template.return_value.template.source = "edited page"
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
@@ -1,9 +1,15 @@
 from django.urls import path
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import etag
 
 from . import views
 
 
 urlpatterns = [
     path("", views.index, name="index"),
-    path("<str:room_name>/", views.room, name="room"),
+    path(
+        "<str:room_name>/",
+        etag(views.room_etag)(cache_page(60)(views.RoomView.as_view())),
+        name="room",
+    ),
 ]
@@ -1,9 +1,25 @@
 from django.shortcuts import render
+from django.template.loader import get_template
+from django.utils.crypto import md5
+from django.views.generic import TemplateView
 
 
 def index(request):
     return render(request, "chatServerApp/index.html")
 
 
-def room(request, room_name):
-    return render(request, "chatServerApp/room.html", {"room_name": room_name})
+class RoomView(TemplateView):
+    template_name = "chatServerApp/room.html"
+
+    def get_context_data(self, **kwargs):
+        return {"room_name": self.kwargs["room_name"]}
+
+
+def room_etag(request, room_name):
+    # The page depends on the room name and the template, so an edited page is
+    # never answered with a 304 for the old one; hashing keeps the header ASCII.
+    # This runs on every request, cache hits included. The cached template
+    # loader usually makes the lookup cheap, but it reloads the template from
+    # disk after runserver's autoreload resets it
+    source = get_template(RoomView.template_name).template.source
+    return md5((source + room_name).encode(), usedforsecurity=False).hexdigest()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -74,17 +75,35 @@ TEMPLATES = [
 WSGI_APPLICATION = 'chat_server.wsgi.application'
 
 ASGI_APPLICATION = 'chat_server.asgi.application'
-CHANNEL_LAYERS = {
-    # "default": {
-    #     "BACKEND": "channels_redis.core.RedisChannelLayer",
-    #     "CONFIG": {
-    #         "hosts": [("127.0.0.1", 6379)],
-    #     },
-    # },
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+
+# Comma separated Redis URLs, e.g. "redis://redis-1:6379,redis://redis-2:6379".
+# Each room group is hashed to one of these hosts, so a broadcast is a single
+# PUBLISH on the host owning the room instead of a write per channel.
+CHANNEL_REDIS_HOSTS = os.environ.get('CHANNEL_REDIS_HOSTS')
+
+if CHANNEL_REDIS_HOSTS:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_HOSTS.split(','),
+            },
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
+    }
+
+# Seconds a chat consumer waits to coalesce room messages into one frame
+CHAT_FLUSH_DELAY = 0.005
+
+# A chat consumer whose client falls this many messages behind, or whose send
+# takes longer than this many seconds, is closed with 1013 (try again later)
+CHAT_MAX_BUFFERED = 1000
+CHAT_SEND_TIMEOUT = 2.0
 
 
 # Database